@@ -1,14 +1,19 @@
 #!/usr/bin/env python3
 
 
-from datetime import date, timedelta
+from datetime import date
+import json
 import math
-import csv
+import sys
+import numpy as np
 import pandas as pd
+from numba import njit
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.drawing.image import Image
-from openpyxl.utils.dataframe import dataframe_to_rows
 from openpyxl.styles import Alignment, Font
 from openpyxl.utils import get_column_letter
 
@@ -17,10 +22,10 @@ from openpyxl.utils import get_column_letter
 # ----------------------------------
 
 def nominal_to_effective_annual(nominal_rate, comp_per_year):
-    return (1 + nominal_rate / comp_per_year) ** comp_per_year - 1
+    return math.expm1(comp_per_year * math.log1p(nominal_rate / comp_per_year))
 
 def effective_annual_to_period_rate(eff_annual, payments_per_year):
-    return (1 + eff_annual) ** (1 / payments_per_year) - 1
+    return math.expm1(math.log1p(eff_annual) / payments_per_year)
 
 def anticipada_to_vencida(rate_anticipada):
     return rate_anticipada / (1 - rate_anticipada)
@@ -43,99 +48,204 @@ def parse_rate(rate_value, rate_type, rate_kind, nominal_comp_per_year, payments
 def cuota_frances(principal, tasa, n_periodos):
     if tasa == 0:
         return principal / n_periodos
-    return principal * (tasa * (1 + tasa) ** n_periodos) / ((1 + tasa) ** n_periodos - 1)
-
-def generar_tabla(principal, tasa, n_periodos, frecuencia, abonos, reducir):
-    saldo = principal
+    # (1 + tasa)^n - 1 calculado una sola vez y sin perder precisión en tasas pequeñas
+    f = math.expm1(n_periodos * math.log1p(tasa))
+    return principal * tasa * (f + 1) / f
+
+COLUMNAS = [
+    "Periodo",
+    "Fecha",
+    "Cuota ($)",
+    "Interés ($)",
+    "Abono a Capital ($)",
+    "Abono Extra ($)",
+    "Saldo Restante ($)",
+]
+
+# Fecha ocupa siempre 10 caracteres y los montos redondeados a 2 decimales
+# caben en 12, así que los anchos no dependen del número de filas.
+ANCHOS_COLUMNAS = {
+    "Periodo": 9,
+    "Fecha": 12,
+    "Cuota ($)": 14,
+    "Interés ($)": 14,
+    "Abono a Capital ($)": 21,
+    "Abono Extra ($)": 17,
+    "Saldo Restante ($)": 20,
+}
+
+def _tabla_vectorizada(principal, tasa, n_periodos, abonos_arr):
+    # Cuota fija: el saldo tiene forma cerrada y los abonos extra se
+    # acumulan capitalizados, sin recorrer los periodos uno a uno.
     cuota = cuota_frances(principal, tasa, n_periodos)
-    tabla = []
-    fecha = date.today()
+    k = np.arange(1, n_periodos + 1)
+    abono_extra = abonos_arr[1:]
+
+    if tasa == 0:
+        # Sin interés el saldo baja linealmente: no hace falta calcular potencias
+        saldo = principal - k * cuota - np.cumsum(abono_extra)
+    else:
+        # Saldo como valor presente de las cuotas que faltan: restar
+        # principal·(1+i)^k y cuota·((1+i)^k - 1)/i amplificaba el error de
+        # redondeo con (1+i)^k en plazos largos.
+        log_factor = math.log1p(tasa)
+        saldo = cuota * -np.expm1(-(n_periodos - k) * log_factor) / tasa
+        potencia = np.exp(k * log_factor)
+        saldo -= potencia * np.cumsum(abono_extra / potencia)
+
+    # El crédito termina en el primer periodo en que el saldo llega a cero
+    liquidado = np.flatnonzero(saldo <= 1e-6)
+    if liquidado.size:
+        fin = liquidado[0] + 1
+        saldo, abono_extra = saldo[:fin], abono_extra[:fin]
+    saldo = np.maximum(saldo, 0)
+
+    if tasa == 0:
+        interes = np.zeros_like(saldo)
+        abono_capital = np.full_like(saldo, cuota)
+    else:
+        interes = np.empty_like(saldo)
+        interes[0] = principal * tasa
+        interes[1:] = saldo[:-1] * tasa
+        abono_capital = cuota - interes
+
+    return np.full_like(saldo, cuota), interes, abono_capital, abono_extra, saldo
+
+@njit(cache=True)
+def _simulate_core(principal, tasa, n_periodos, cuota, abonos_arr):
+    # Recurrencia periodo a periodo para reducir="plazo": la cuota se recalcula
+    # sobre el saldo vivo tras cada abono extra. La cuota inicial llega ya
+    # calculada con cuota_frances, que lanza OverflowError en plazos enormes.
+    cuota_arr = np.empty(n_periodos)
+    interes_arr = np.empty(n_periodos)
+    abono_capital_arr = np.empty(n_periodos)
+    abono_extra_arr = np.empty(n_periodos)
+    saldo_arr = np.empty(n_periodos)
 
+    saldo = principal
+    m = 0
     for periodo in range(1, n_periodos + 1):
         interes = saldo * tasa
         abono_capital = cuota - interes
-        abono_extra = abonos.get(periodo, 0)
-        saldo -= (abono_capital + abono_extra)
+        abono_extra = abonos_arr[periodo]
+        saldo -= abono_capital + abono_extra
 
         if saldo < 0:
-            saldo = 0
+            saldo = 0.0
+
+        cuota_arr[m] = cuota
+        interes_arr[m] = interes
+        abono_capital_arr[m] = abono_capital
+        abono_extra_arr[m] = abono_extra
+        saldo_arr[m] = saldo
+        m += 1
+
+        n_restante = n_periodos - periodo
+        if abono_extra > 0 and n_restante > 0:
+            if tasa == 0:
+                cuota = saldo / n_restante
+            else:
+                f = math.expm1(n_restante * math.log1p(tasa))
+                cuota = saldo * tasa * (f + 1) / f
 
-        tabla.append({
-            "Periodo": periodo,
-            "Fecha": fecha.strftime("%d/%m/%Y"),
-            "Cuota ($)": round(cuota, 2),
-            "Interés ($)": round(interes, 2),
-            "Abono a Capital ($)": round(abono_capital, 2),
-            "Abono Extra ($)": round(abono_extra, 2),
-            "Saldo Restante ($)": round(saldo, 2)
-        })
+        if saldo <= 1e-6:
+            break
 
-        if abono_extra > 0 and reducir == "plazo":
-            n_restante = n_periodos - periodo
-            cuota = cuota_frances(saldo, tasa, n_restante)
+    return cuota_arr[:m], interes_arr[:m], abono_capital_arr[:m], abono_extra_arr[:m], saldo_arr[:m]
 
-        fecha += timedelta(days=30)
+def _fechas_pago(n):
+    # Fechas cada 30 días desde hoy: AAAA-MM-DD reordenado a DD/MM/AAAA
+    iso = np.datetime_as_string(np.datetime64(date.today(), "D") + 30 * np.arange(n)).astype("U10")
+    caracteres = iso.view("U1").reshape(n, 10)[:, [8, 9, 4, 5, 6, 7, 0, 1, 2, 3]]
+    caracteres[:, [2, 5]] = "/"
+    return np.ascontiguousarray(caracteres).view("U10").ravel()
 
-        if saldo <= 1e-6:
-            break
+def generar_tabla(principal, tasa, n_periodos, frecuencia, abonos, reducir):
+    # Abonos por periodo en un arreglo denso (índice 0 sin usar)
+    abonos_arr = np.zeros(n_periodos + 1, dtype=np.float64)
+    for periodo, monto in abonos.items():
+        if 1 <= periodo <= n_periodos:
+            abonos_arr[periodo] = monto
+
+    if abonos and reducir == "plazo":
+        # Con abonos que recalculan la cuota cada periodo depende del anterior
+        cuota = cuota_frances(principal, tasa, n_periodos)
+        columnas = _simulate_core(float(principal), float(tasa), n_periodos, float(cuota), abonos_arr)
+    else:
+        columnas = _tabla_vectorizada(principal, tasa, n_periodos, abonos_arr)
 
-    return tabla
+    n = len(columnas[0])
+    datos = {"Periodo": np.arange(1, n + 1), "Fecha": _fechas_pago(n)}
+    for columna, valores in zip(COLUMNAS[2:], columnas):
+        datos[columna] = np.round(valores, 2)
+    return pd.DataFrame(datos, copy=False)
 
 # ----------------------------------
 # Exportar CSV y XLSX
 # ----------------------------------
 
+# Estilos compartidos por todas las celdas que los usan
+FUENTE_TITULO = Font(size=14, bold=True)
+FUENTE_ENCABEZADO = Font(bold=True)
+ALINEACION_CENTRO = Alignment(horizontal="center")
+
 def exportar_archivos(tabla):
     csv_name = "tabla_amortizacion.csv"
-    with open(csv_name, "w", newline="", encoding="utf-8-sig") as f:
-        escritor = csv.DictWriter(f, fieldnames=tabla[0].keys())
-        escritor.writeheader()
-        escritor.writerows(tabla)
+    # Las columnas ya vienen redondeadas a 2 decimales desde generar_tabla; al ser
+    # float64, los montos enteros se escriben como 0.0 o 500000.0
+    tabla.to_csv(csv_name, index=False, encoding="utf-8-sig")
     print(f"\n✅ Archivo CSV generado: {csv_name}")
 
-    df = pd.DataFrame(tabla)
     xlsx_name = "tabla_amortizacion.xlsx"
 
-    plt.figure(figsize=(8, 4))
-    plt.bar(df["Periodo"], df["Cuota ($)"], color="#009FE3", label="Cuota total")
-    plt.bar(df["Periodo"], df["Interés ($)"], color="#F4B400", label="Interés")
-    plt.bar(df["Periodo"], df["Abono a Capital ($)"], color="#34A853", label="Abono capital")
-    plt.title("Distribución de Pagos - Simulación de Crédito")
-    plt.xlabel("Periodo")
-    plt.ylabel("Valor ($)")
-    plt.legend()
-    plt.tight_layout()
+    periodos = tabla["Periodo"].to_numpy()
+    n_periodos = len(periodos)
+    interes = tabla["Interés ($)"].to_numpy()
+    abono_capital = tabla["Abono a Capital ($)"].to_numpy()
+    abono_extra = tabla["Abono Extra ($)"].to_numpy()
+
+    # Barras apiladas: interés + capital forman la cuota, encima el abono extra
+    fig, ax = plt.subplots(figsize=(8, 4))
+    ax.bar(periodos, interes, color="#F4B400", label="Interés")
+    ax.bar(periodos, abono_capital, bottom=interes, color="#34A853", label="Abono capital")
+    ax.bar(periodos, abono_extra, bottom=interes + abono_capital, color="#009FE3", label="Abono extra")
+    ax.set_title("Distribución de Pagos - Simulación de Crédito")
+    ax.set_xlabel("Periodo")
+    ax.set_ylabel("Valor ($)")
+    ax.legend()
+    fig.tight_layout()
     grafico = "grafico_pagos.png"
-    plt.savefig(grafico, dpi=150)
-    plt.close()
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Tabla de Amortización"
-
-    ws["A1"] = "Tabla de Amortización - Simulación de Crédito"
-    ws["A1"].font = Font(size=14, bold=True)
-    ws.merge_cells("A1:G1")
-    ws["A1"].alignment = Alignment(horizontal="center")
-
-    for r in dataframe_to_rows(df, index=False, header=True):
-        ws.append(r)
-
-    for i, col in enumerate(ws.columns, start=1):
-        max_length = 0
-        column = get_column_letter(i)
-        for cell in col:
-            try:
-                if cell.value:
-                    max_length = max(max_length, len(str(cell.value)))
-            except:
-                pass
-        ws.column_dimensions[column].width = max_length + 2
+    fig.savefig(grafico, dpi=150)
+    plt.close(fig)
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Tabla de Amortización")
+
+    # En modo write-only los anchos deben fijarse antes de escribir filas
+    for i, columna in enumerate(COLUMNAS, start=1):
+        ws.column_dimensions[get_column_letter(i)].width = ANCHOS_COLUMNAS[columna]
+
+    titulo = WriteOnlyCell(ws, value="Tabla de Amortización - Simulación de Crédito")
+    titulo.font = FUENTE_TITULO
+    titulo.alignment = ALINEACION_CENTRO
+    ws.append([titulo])
+    ws.merged_cells.add("A1:G1")
+
+    encabezado = []
+    for columna in COLUMNAS:
+        celda = WriteOnlyCell(ws, value=columna)
+        celda.font = FUENTE_ENCABEZADO
+        encabezado.append(celda)
+    ws.append(encabezado)
+
+    for fila in zip(*(tabla[columna].tolist() for columna in COLUMNAS)):
+        ws.append(fila)
 
     img = Image(grafico)
     img.width = 600
     img.height = 300
-    ws.add_image(img, f"A{len(df) + 4}")
+    # Título, encabezado y n_periodos filas: la gráfica va dos filas más abajo
+    ws.add_image(img, f"A{n_periodos + 4}")
 
     wb.save(xlsx_name)
     print(f"✅ Archivo XLSX generado: {xlsx_name}")
@@ -159,6 +269,21 @@ def pedir_int(mensaje):
         except ValueError:
             print("❌ Entrada inválida. Debe ser un número entero. Intenta de nuevo.")
 
+def _simular(principal, tasa_periodo, plazo, frecuencia, abonos, reducir):
+    # Parte común de run() y main() una vez conocida la tasa por periodo.
+    # Las claves de un objeto JSON llegan como texto
+    abonos = {int(p): float(monto) for p, monto in (abonos or {}).items()}
+    return generar_tabla(principal, tasa_periodo, plazo, frecuencia, abonos, reducir)
+
+def run(principal, tasa_valor, tipo_tasa, clase_tasa, capitalizacion, frecuencia, plazo,
+        abonos=None, reducir="cuota", exportar=False):
+    # Simulación sin interacción: útil para lotes de escenarios (JSON, procesos en paralelo)
+    tasa_periodo = parse_rate(tasa_valor, tipo_tasa, clase_tasa, capitalizacion, frecuencia)
+    tabla = _simular(principal, tasa_periodo, plazo, frecuencia, abonos, reducir)
+    if exportar:
+        exportar_archivos(tabla)
+    return tabla
+
 def main():
     print("=== SIMULADOR DE CRÉDITO - TABLA DE AMORTIZACIÓN ===\n")
 
@@ -188,16 +313,20 @@ def main():
     if abonos:
         reducir = input("\nTras abono extra, ¿reducir 'plazo' o 'cuota'?: ").strip().lower()
 
-    tabla = generar_tabla(principal, tasa_periodo, plazo, frecuencia, abonos, reducir)
+    tabla = _simular(principal, tasa_periodo, plazo, frecuencia, abonos, reducir)
 
     print("\n=== TABLA DE AMORTIZACIÓN ===")
-    for fila in tabla:
-        print(fila)
+    print(tabla.to_string(index=False))
 
     exportar_archivos(tabla)
 
-    saldo_final = tabla[-1]["Saldo Restante ($)"]
+    saldo_final = tabla["Saldo Restante ($)"].iloc[-1]
     print(f"\nSaldo final: ${saldo_final:.2f}")
 
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding="utf-8") as f:
+            tabla = run(**json.load(f))
+        print(tabla.to_string(index=False))
+    else:
+        main()